@@ -2,25 +2,81 @@
 Configuration for Medical Guideline Validation System
 """
 
-import os
-from dotenv import load_dotenv
+from typing import Optional
 
-# Load environment variables from .env file
-load_dotenv()
+from pydantic import SecretStr
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
-# OpenAI Configuration
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o")
-OPENAI_TEMPERATURE = float(os.environ.get("OPENAI_TEMPERATURE", "0.1"))
 
-# Guidelines Storage
-GUIDELINES_DIR = "data/guidelines"
-VECTOR_STORE_PATH = "./vector_store_guidelines"
+class Settings(BaseSettings):
+    """Typed settings validated once at import by pydantic-core.
 
-# API Configuration
-API_HOST = os.environ.get("API_HOST", "0.0.0.0")
-API_PORT = int(os.environ.get("API_PORT", "8000"))
-API_RELOAD = os.environ.get("API_RELOAD", "False").lower() == "true"
+    Frozen so the object is safe to share across threads; .env handling
+    is done by pydantic-settings itself (no load_dotenv side effects).
+    """
+
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        frozen=True,
+        extra="ignore"
+    )
+
+    # OpenAI Configuration
+    openai_api_key: Optional[SecretStr] = None
+    openai_model: str = "gpt-4o"
+    openai_temperature: float = 0.1
+
+    # Validation cascade and rate limiting
+    escalate_on_critical: bool = True
+    openai_max_concurrency: int = 8
+    openai_rate_limit_retries: int = 5
+
+    # Response cache (disk tier is opt-in)
+    medguide_disk_cache: bool = False
+    medguide_cache_dir: str = "~/.medguide_cache"
+    medguide_semantic_threshold: float = 0.97
+
+    # Guidelines Storage
+    guidelines_dir: str = "data/guidelines"
+    vector_store_path: str = "./vector_store_guidelines_v2"
+
+    # API Configuration
+    api_host: str = "0.0.0.0"
+    api_port: int = 8000
+    api_reload: bool = False
+
+    # Connection handling: generous keep-alive so clients fanning out many
+    # /validate/* calls reuse connections instead of re-handshaking TCP/TLS
+    api_backlog: int = 2048
+    api_keepalive_timeout: int = 75
+
+
+settings = Settings()
+
+# Module-level aliases kept for existing call sites
+OPENAI_API_KEY = (
+    settings.openai_api_key.get_secret_value()
+    if settings.openai_api_key else None
+)
+OPENAI_MODEL = settings.openai_model
+OPENAI_TEMPERATURE = settings.openai_temperature
+
+ESCALATE_ON_CRITICAL = settings.escalate_on_critical
+OPENAI_MAX_CONCURRENCY = settings.openai_max_concurrency
+OPENAI_RATE_LIMIT_RETRIES = settings.openai_rate_limit_retries
+
+MEDGUIDE_DISK_CACHE = settings.medguide_disk_cache
+MEDGUIDE_CACHE_DIR = settings.medguide_cache_dir
+MEDGUIDE_SEMANTIC_THRESHOLD = settings.medguide_semantic_threshold
+
+GUIDELINES_DIR = settings.guidelines_dir
+VECTOR_STORE_PATH = settings.vector_store_path
+
+API_HOST = settings.api_host
+API_PORT = settings.api_port
+API_RELOAD = settings.api_reload
+API_BACKLOG = settings.api_backlog
+API_KEEPALIVE_TIMEOUT = settings.api_keepalive_timeout
 
 # Validation
 if OPENAI_API_KEY:
@@ -28,4 +84,4 @@ if OPENAI_API_KEY:
 else:
     print("⚠️  WARNING: OPENAI_API_KEY not found!")
     print("   Please add it to your .env file:")
-    print("   OPENAI_API_KEY=sk-your-key-here")
\ No newline at end of file
+    print("   OPENAI_API_KEY=sk-your-key-here")
@@ -3,24 +3,52 @@ Medical Guideline Validation API
 AI-powered clinical decision support using OpenAI GPT-4
 """
 
+import asyncio
+
+import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import uvicorn
 
+# uvloop roughly halves event-loop overhead; optional (not on Windows)
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 from models.schemas import (
     GuidelineCheckRequest,
     GuidelineCheckResponse,
-    QuickGuidelineCheckRequest
+    QuickGuidelineCheckRequest,
+    BatchValidationRequest
 )
 from services.guidelines_validator_service import openai_guideline_validator
 from services.sample_clinical_data import get_patient_data, list_all_patients
 import config
 
+# Bind the hot-path method once: endpoints hit a single module global
+# instead of an attribute-lookup chain on every request, and tests can
+# monkeypatch this name to swap implementations
+_validate_orders = openai_guideline_validator.validate_orders
+
+class APIResponse(ORJSONResponse):
+    """orjson-backed response with non-string dict keys allowed."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_DATACLASS
+        )
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Medical Guideline Validation API",
     description="AI-powered clinical decision support using OpenAI GPT-4",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=APIResponse
 )
 
 # CORS middleware
@@ -51,11 +79,16 @@ async def health_check():
     return {
         "status": "healthy",
         "openai_configured": bool(config.OPENAI_API_KEY),
-        "validator_initialized": openai_guideline_validator.initialized
+        "validator_initialized": openai_guideline_validator.initialized,
+        "openai_usage": openai_guideline_validator.get_usage_stats()
     }
 
 
-@app.post("/validate/guideline-check", response_model=GuidelineCheckResponse)
+@app.post(
+    "/validate/guideline-check",
+    response_model=GuidelineCheckResponse,
+    response_model_exclude_none=True
+)
 async def validate_guideline_check(req: GuidelineCheckRequest):
     """
     AI-powered guideline validation check using OpenAI.
@@ -63,22 +96,44 @@ async def validate_guideline_check(req: GuidelineCheckRequest):
     This endpoint accepts complete patient data and validates active orders
     against clinical guidelines using GPT-4.
     """
-    
-    if not openai_guideline_validator.initialized:
-        openai_guideline_validator.initialize()
-    
-    result = await openai_guideline_validator.validate_orders(
+
+    result = await _validate_orders(
         patient_id=req.patient_id,
         active_orders=req.active_orders,
         clinical_context=req.clinical_context,
         patient_record=req.patient_record,
         specialty=req.specialty
     )
-    
+
     return result
 
 
-@app.post("/validate/quick-check", response_model=GuidelineCheckResponse)
+@app.post("/validate/guideline-check/stream")
+async def validate_guideline_check_stream(req: GuidelineCheckRequest):
+    """
+    Streaming variant of /validate/guideline-check.
+
+    Emits NDJSON: one {"type": "note", ...} line per finding as the AI
+    generates it, followed by a single {"type": "summary", ...} line.
+    """
+
+    return StreamingResponse(
+        openai_guideline_validator.validate_orders_stream(
+            patient_id=req.patient_id,
+            active_orders=req.active_orders,
+            clinical_context=req.clinical_context,
+            patient_record=req.patient_record,
+            specialty=req.specialty
+        ),
+        media_type="application/x-ndjson"
+    )
+
+
+@app.post(
+    "/validate/quick-check",
+    response_model=GuidelineCheckResponse,
+    response_model_exclude_none=True
+)
 async def quick_guideline_check(req: QuickGuidelineCheckRequest):
     """
     Quick AI-powered guideline check using sample patient data.
@@ -93,11 +148,8 @@ async def quick_guideline_check(req: QuickGuidelineCheckRequest):
             status_code=404,
             detail=f"Patient {req.patient_id} not found in sample data. Available: P001, P002, P003"
         )
-    
-    if not openai_guideline_validator.initialized:
-        openai_guideline_validator.initialize()
-    
-    result = await openai_guideline_validator.validate_orders(
+
+    result = await _validate_orders(
         patient_id=req.patient_id,
         active_orders=patient_data["active_orders"],
         clinical_context=patient_data["clinical_context"],
@@ -108,13 +160,49 @@ async def quick_guideline_check(req: QuickGuidelineCheckRequest):
     return result
 
 
-@app.get("/sample-patients")
-async def get_sample_patients():
-    """Get list of available sample patients for testing."""
-    patient_ids = list_all_patients()
-    
+@app.post("/validate/batch")
+async def submit_batch_validation(req: BatchValidationRequest):
+    """
+    Submit a bulk validation job via the OpenAI Batch API.
+
+    Use this for non-interactive workloads (nightly re-validation,
+    regression sweeps): one upload, 24h completion window, 50% token cost.
+    """
+
+    patients = []
+    for pid in req.patient_ids:
+        data = get_patient_data(pid)
+        if not data:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Patient {pid} not found in sample data. Available: P001, P002, P003"
+            )
+        patients.append({
+            "patient_id": pid,
+            "active_orders": data["active_orders"],
+            "clinical_context": data["clinical_context"],
+            "patient_record": data["patient"],
+            "specialty": req.specialty
+        })
+
+    batch_id = await openai_guideline_validator.submit_batch_validation(patients)
+
+    return {
+        "batch_id": batch_id,
+        "status": "submitted",
+        "patient_count": len(patients)
+    }
+
+
+@app.get("/validate/batch/{batch_id}")
+async def get_batch_validation(batch_id: str):
+    """Poll a batch validation job; returns results once completed."""
+    return await openai_guideline_validator.collect_batch_results(batch_id)
+
+
+def _build_patients_info():
     patients_info = []
-    for pid in patient_ids:
+    for pid in list_all_patients():
         data = get_patient_data(pid)
         if data:
             patients_info.append({
@@ -124,13 +212,23 @@ async def get_sample_patients():
                 "diagnosis": data["patient"]["current_diagnosis"],
                 "department": data["patient"]["department"]
             })
-    
+
     return {
         "total_patients": len(patients_info),
         "patients": patients_info
     }
 
 
+# Sample data is static, so the aggregated listing is built once
+_PATIENTS_INFO_CACHE = _build_patients_info()
+
+
+@app.get("/sample-patients")
+async def get_sample_patients():
+    """Get list of available sample patients for testing."""
+    return _PATIENTS_INFO_CACHE
+
+
 @app.get("/patient-details/{patient_id}")
 async def get_patient_details(patient_id: str):
     """Get complete details for a sample patient."""
@@ -156,15 +254,25 @@ async def startup():
     print(f"📚 API Docs: http://localhost:{config.API_PORT}/docs")
     print("="*80 + "\n")
     
-    openai_guideline_validator.initialize()
+    # Run the blocking model/vector-store load off the event loop;
+    # endpoints rely on this being the single initialization point.
+    await asyncio.to_thread(openai_guideline_validator.initialize)
     print("✅ All services initialized and ready!")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Release shared HTTP resources."""
+    await openai_guideline_validator.aclose()
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
         host=config.API_HOST,
         port=config.API_PORT,
         reload=config.API_RELOAD,
+        backlog=config.API_BACKLOG,
+        timeout_keep_alive=config.API_KEEPALIVE_TIMEOUT,
         log_level="info"
     )
\ No newline at end of file
@@ -2,8 +2,8 @@
 Pydantic models for API request/response validation
 """
 
-from typing import Optional, List, Any, Dict
-from pydantic import BaseModel
+from typing import Optional, Any
+from pydantic import BaseModel, ConfigDict
 from enum import Enum
 
 
@@ -19,31 +19,37 @@ class SeverityLevel(str, Enum):
 
 class MedicalNote(BaseModel):
     """A single medical note about a guideline deviation or concern."""
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
     issue: str
     reasoning: str
-    affected_orders: List[str]
+    affected_orders: list[str]
     severity: SeverityLevel
-    recommendations: List[str]
+    recommendations: list[str]
     guideline_reference: Optional[str] = None
     requires_human_review: bool = False
 
 
 class GuidelineCheckRequest(BaseModel):
     """Full guideline validation request with complete patient data."""
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
     patient_id: str
-    active_orders: Dict[str, List[Dict[str, Any]]]
-    clinical_context: Dict[str, Any]
-    patient_record: Dict[str, Any]
+    active_orders: dict[str, list[dict[str, Any]]]
+    clinical_context: dict[str, Any]
+    patient_record: dict[str, Any]
     specialty: Optional[str] = None
 
 
 class GuidelineCheckResponse(BaseModel):
     """Response from guideline validation check."""
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
     patient_id: str
     check_timestamp: str
     overall_severity: SeverityLevel
     summary: str
-    medical_notes: List[MedicalNote]
+    medical_notes: list[MedicalNote]
     total_issues_found: int
     critical_count: int
     high_count: int
@@ -51,10 +57,20 @@ class GuidelineCheckResponse(BaseModel):
     routine_count: int
     safety_disclaimer: str
     requires_urgent_review: bool
-    guidelines_consulted: List[str]
+    guidelines_consulted: list[str]
 
 
 class QuickGuidelineCheckRequest(BaseModel):
     """Simplified request using patient_id to fetch sample data."""
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
     patient_id: str
+    specialty: Optional[str] = None
+
+
+class BatchValidationRequest(BaseModel):
+    """Bulk validation request submitted via the OpenAI Batch API."""
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
+    patient_ids: list[str]
     specialty: Optional[str] = None
\ No newline at end of file
@@ -4,6 +4,14 @@ Retrieves relevant medical guidelines, protocols, and treatment standards
 """
 
 import os
+import re
+import json
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 
@@ -29,6 +37,100 @@ except Exception as e:
     RAG_AVAILABLE = False
 
 
+# HNSW settings for the guideline collection: cosine over unit vectors
+# reduces to a dot product, and embeddings are L2-normalized at encode time
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+    "hnsw:M": 32
+}
+
+# Known specialty folder names, used to tag guideline documents
+SPECIALTIES = frozenset({
+    "cardiology", "neurology", "surgery", "pediatrics",
+    "oncology", "emergency", "general", "infectious",
+    "pulmonary", "respiratory", "icu", "critical"
+})
+
+# One C-level scan of the full path instead of a Python loop over parts
+_SPECIALTY_RE = re.compile(
+    r"(?i)(?:^|[\\/])(" + "|".join(sorted(SPECIALTIES)) + r")(?:[\\/]|$)"
+)
+
+
+# =========================
+# Optional ONNX int8 embeddings
+# =========================
+try:
+    import numpy as np
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    ONNX_AVAILABLE = True
+except Exception:
+    ONNX_AVAILABLE = False
+
+
+class ONNXMiniLMEmbeddings:
+    """
+    int8-quantized MiniLM embeddings via ONNX Runtime (CPU).
+
+    Drop-in replacement for HuggingFaceEmbeddings: dynamic int8
+    quantization halves bytes moved per matmul and uses VNNI int8
+    dot-products where available, while keeping the same 384-dim
+    vectors — so the Chroma collection needs no migration.
+    """
+
+    MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+    def __init__(self, cache_dir: str = "./onnx_minilm_int8", batch_size: int = 64):
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(self.MODEL_NAME)
+
+        # Export + quantize once, then reuse the cached int8 model
+        if not os.path.exists(cache_dir):
+            print("⚙️  Exporting MiniLM to ONNX and quantizing to int8...")
+            model = ORTModelForFeatureExtraction.from_pretrained(
+                self.MODEL_NAME, export=True
+            )
+            quantizer = ORTQuantizer.from_pretrained(model)
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False)
+            quantizer.quantize(save_dir=cache_dir, quantization_config=qconfig)
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            cache_dir, provider="CPUExecutionProvider"
+        )
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=256,
+                return_tensors="np"
+            )
+            hidden = self.model(**inputs).last_hidden_state
+
+            # Mean-pool over tokens, then L2-normalize
+            mask = inputs["attention_mask"][..., None]
+            pooled = (hidden * mask).sum(axis=1) / mask.sum(axis=1)
+            pooled = pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+            vectors.extend(pooled.tolist())
+
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+
 class GuidelinesService:
     """Service for retrieving clinical guidelines using RAG."""
 
@@ -38,38 +140,88 @@ class GuidelinesService:
         self.initialized = False
         self.rag_available = RAG_AVAILABLE
         self.guidelines_dir = "data/guidelines"
-        self.vector_store_path = "./vector_store_guidelines"
+        # v2: rebuilt with cosine space (old L2 index is left untouched)
+        self.vector_store_path = "./vector_store_guidelines_v2"
+        self._emb_cache_path = os.path.join(
+            self.vector_store_path, "emb_cache.sqlite"
+        )
+        self._init_lock = threading.Lock()
+        # Column-style table of (name, path, suffix, specialty) rows,
+        # built by a single directory scan at load time
+        self._file_index: List[Tuple[str, str, str, str]] = []
+        # Lazily-built retrievers keyed by k so per-call kwargs dicts
+        # are constructed once
+        self._retrievers: Dict[int, object] = {}
 
     # =========================
     # Initialization
     # =========================
     def initialize(self):
+        # Double-checked lock: cheap fast path for the common case,
+        # guaranteed single expensive load under concurrent callers
         if self.initialized:
             return
 
-        if not self.rag_available:
+        with self._init_lock:
+            if self.initialized:
+                return
+            self._do_initialize()
             self.initialized = True
+
+    def _do_initialize(self):
+        if not self.rag_available:
             return
 
         print("🏥 Initializing Clinical Guidelines Assistant...")
 
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={"device": "cpu"}
-        )
-
-        print("✅ Embeddings model loaded")
+        if ONNX_AVAILABLE:
+            self.embeddings = ONNXMiniLMEmbeddings()
+            print("✅ Embeddings model loaded (ONNX int8)")
+        else:
+            self.embeddings = HuggingFaceEmbeddings(
+                model_name="sentence-transformers/all-MiniLM-L6-v2",
+                model_kwargs={"device": "cpu"},
+                encode_kwargs={"batch_size": 64, "normalize_embeddings": True}
+            )
+            print("✅ Embeddings model loaded")
         self._load_guidelines()
-        self.initialized = True
         print("✅ Clinical Guidelines system initialized")
 
     # =========================
     # Loading
     # =========================
+    def _scan_guidelines_dir(self) -> List[Tuple[str, str, str, str]]:
+        """Walk the guidelines tree once with os.scandir."""
+        rows = []
+        stack = [self.guidelines_dir]
+
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file():
+                            suffix = os.path.splitext(entry.name)[1].lower()
+                            rows.append((
+                                entry.name,
+                                entry.path,
+                                suffix,
+                                self._get_specialty_from_path(entry.path)
+                            ))
+            except FileNotFoundError:
+                continue
+
+        return rows
+
     def _load_guidelines(self):
         os.makedirs(self.guidelines_dir, exist_ok=True)
+        self._file_index = self._scan_guidelines_dir()
 
-        if os.path.exists(self.vector_store_path):
+        # Check for the actual Chroma database, not just the directory —
+        # the embedding sidecar cache lives in the same folder
+        if os.path.exists(os.path.join(self.vector_store_path, "chroma.sqlite3")):
             print("📚 Loading existing vector store...")
             self.vectorstore = Chroma(
                 embedding_function=self.embeddings,
@@ -78,27 +230,35 @@ class GuidelinesService:
             print("✅ Loaded existing guidelines database")
             return
 
-        documents: List[Document] = []
+        pairs = []
+        for name, path, suffix, specialty in self._file_index:
+            if suffix == ".pdf":
+                pairs.append((name, specialty, PyPDFLoader(path)))
+            elif suffix == ".txt":
+                pairs.append((name, specialty, TextLoader(path)))
 
-        for file in Path(self.guidelines_dir).rglob("*"):
-            if file.suffix.lower() == ".pdf":
-                loader = PyPDFLoader(str(file))
-            elif file.suffix.lower() == ".txt":
-                loader = TextLoader(str(file))
-            else:
-                continue
+        documents: List[Document] = []
 
-            docs = loader.load()
-            for doc in docs:
-                doc.metadata["source_file"] = file.name
-                doc.metadata["specialty"] = self._get_specialty_from_path(str(file))
-            documents.extend(docs)
-            print(f"   ✅ Loaded: {file.name}")
+        if pairs:
+            # Parse files in parallel — PDF parsing is I/O plus pure-Python
+            # CPU work, and PyPDF is safe when reading distinct files
+            with ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 4)
+            ) as executor:
+                loaded = executor.map(lambda p: p[2].load(), pairs)
+
+                for (name, specialty, _), docs in zip(pairs, loaded):
+                    for doc in docs:
+                        doc.metadata["source_file"] = name
+                        doc.metadata["specialty"] = specialty
+                    documents.extend(docs)
+                    print(f"   ✅ Loaded: {name}")
 
         if not documents:
             self.vectorstore = Chroma(
                 embedding_function=self.embeddings,
-                persist_directory=self.vector_store_path
+                persist_directory=self.vector_store_path,
+                collection_metadata=COLLECTION_METADATA
             )
             return
 
@@ -110,34 +270,107 @@ class GuidelinesService:
         chunks = splitter.split_documents(documents)
         print(f"✂️  Created {len(chunks)} text chunks")
 
-        self.vectorstore = Chroma.from_documents(
-            chunks,
-            self.embeddings,
-            persist_directory=self.vector_store_path
+        # Display snippet is sliced once here rather than on every query
+        for chunk in chunks:
+            chunk.metadata["snippet"] = chunk.page_content[:500].strip()
+
+        # Embed all chunks in one explicit batched pass (MiniLM is far faster
+        # on large batches than on the one-at-a-time dispatch Chroma does);
+        # content-hashed vectors persist across restarts so only new or
+        # changed chunks pay the embedding cost
+        texts = [chunk.page_content for chunk in chunks]
+        hashes = [
+            hashlib.blake2b(text.encode("utf-8")).hexdigest()
+            for text in texts
+        ]
+        vectors = self._embed_with_cache(texts, hashes)
+
+        # Content hashes double as collection ids; dedupe identical chunks
+        unique = {}
+        for chunk, text, h, vec in zip(chunks, texts, hashes, vectors):
+            if h not in unique:
+                unique[h] = (text, chunk.metadata, vec)
+
+        self.vectorstore = Chroma(
+            embedding_function=self.embeddings,
+            persist_directory=self.vector_store_path,
+            collection_metadata=COLLECTION_METADATA
+        )
+        self.vectorstore._collection.add(
+            embeddings=[vec for _, _, vec in unique.values()],
+            documents=[text for text, _, _ in unique.values()],
+            metadatas=[meta for _, meta, _ in unique.values()],
+            ids=list(unique.keys())
         )
 
         print(f"✅ Guidelines loaded: {len(documents)} docs → {len(chunks)} chunks")
 
+    def _embed_with_cache(
+        self,
+        texts: List[str],
+        hashes: List[str]
+    ) -> List[List[float]]:
+        """Embed texts, reusing content-hashed vectors from earlier runs."""
+
+        os.makedirs(self.vector_store_path, exist_ok=True)
+        conn = sqlite3.connect(self._emb_cache_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, vec BLOB)"
+        )
+
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+
+        for i, h in enumerate(hashes):
+            row = conn.execute(
+                "SELECT vec FROM cache WHERE hash = ?", (h,)
+            ).fetchone()
+            if row:
+                vectors[i] = json.loads(row[0])
+            else:
+                missing.setdefault(h, []).append(i)
+
+        if missing:
+            miss_hashes = list(missing.keys())
+            miss_texts = [texts[missing[h][0]] for h in miss_hashes]
+            embedded = self.embeddings.embed_documents(miss_texts)
+
+            for h, vec in zip(miss_hashes, embedded):
+                for i in missing[h]:
+                    vectors[i] = vec
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (hash, vec) VALUES (?, ?)",
+                    (h, json.dumps(vec))
+                )
+            conn.commit()
+
+        conn.close()
+
+        cached = len(texts) - sum(len(v) for v in missing.values())
+        print(f"🧮 Embeddings: {len(missing)} new, {cached} from cache")
+
+        return vectors
+
     # =========================
     # Specialty detection
     # =========================
     def _get_specialty_from_path(self, filepath: str) -> str:
-        specialties = {
-            "cardiology", "neurology", "surgery", "pediatrics",
-            "oncology", "emergency", "general", "infectious",
-            "pulmonary", "respiratory", "icu", "critical"
-        }
-
-        for part in Path(filepath).parts:
-            if part.lower() in specialties:
-                return part.lower()
-
-        return "general"
+        m = _SPECIALTY_RE.search(filepath)
+        return m.group(1).lower() if m else "general"
 
     # =========================
     # Search
     # =========================
-    def search_guidelines(
+    def _get_retriever(self, k: int):
+        retriever = self._retrievers.get(k)
+
+        if retriever is None:
+            retriever = self.vectorstore.as_retriever(search_kwargs={"k": k})
+            self._retrievers[k] = retriever
+
+        return retriever
+
+    async def search_guidelines(
         self,
         query: str,
         k: int = 3,
@@ -148,21 +381,32 @@ class GuidelinesService:
             return []
 
         try:
+            # One HNSW traversal: over-fetch unfiltered and post-filter by
+            # specialty in Python, instead of paying a second graph search
+            # whenever the specialty filter comes back empty
+            fetch_k = k * 3 if filter_specialty else k
+            retriever = self._get_retriever(fetch_k)
+
+            # Chroma search is synchronous; run it off the event loop so
+            # concurrent requests are not blocked behind the HNSW traversal
+            results = await asyncio.to_thread(
+                retriever.get_relevant_documents, query
+            )
+
             if filter_specialty:
-                results = self.vectorstore.similarity_search(
-                    query,
-                    k=k,
-                    filter={"specialty": filter_specialty}
-                )
-                if not results:
-                    # 🔁 fallback if specialty too strict
-                    results = self.vectorstore.similarity_search(query, k=k)
-            else:
-                results = self.vectorstore.similarity_search(query, k=k)
+                matched = [
+                    d for d in results
+                    if d.metadata.get("specialty") == filter_specialty
+                ]
+                if len(matched) < k:
+                    # 🔁 top up from the unfiltered hits if specialty too strict
+                    matched += [d for d in results if d not in matched]
+                results = matched[:k]
 
             return [
                 {
                     "content": d.page_content,
+                    "snippet": d.metadata.get("snippet", d.page_content[:500].strip()),
                     "source": d.metadata.get("source_file"),
                     "page": d.metadata.get("page", "N/A"),
                     "specialty": d.metadata.get("specialty", "general")
@@ -176,7 +420,7 @@ class GuidelinesService:
     # =========================
     # Recommendations
     # =========================
-    def get_protocol_recommendation(
+    async def get_protocol_recommendation(
         self,
         condition: str,
         patient_context: Optional[Dict] = None,
@@ -194,7 +438,9 @@ class GuidelinesService:
             if patient_context.get("conditions"):
                 query += " " + " ".join(patient_context["conditions"])
 
-        guidelines = self.search_guidelines(query, k=3, filter_specialty=specialty)
+        guidelines = await self.search_guidelines(
+            query, k=3, filter_specialty=specialty
+        )
 
         if not guidelines:
             return f"No guidelines found for '{condition}'.", []
@@ -210,7 +456,7 @@ class GuidelinesService:
 
         for i, g in enumerate(guidelines, 1):
             text += f"**{i}. {g['source']}** [{g['specialty']}]\n"
-            text += g["content"][:500].strip() + "\n\n---\n\n"
+            text += g["snippet"] + "\n\n---\n\n"
 
         return text, guidelines
 
@@ -221,18 +467,18 @@ class GuidelinesService:
         if not self.vectorstore:
             return {"status": "empty"}
 
-        files = {}
-        for root, _, fs in os.walk(self.guidelines_dir):
-            for f in fs:
-                if f.endswith((".pdf", ".txt")):
-                    spec = self._get_specialty_from_path(os.path.join(root, f))
-                    files.setdefault(spec, []).append(f)
+        # Reuse the file index built at load time — no second tree walk
+        by_specialty = Counter(
+            specialty
+            for _, _, suffix, specialty in self._file_index
+            if suffix in (".pdf", ".txt")
+        )
 
         return {
             "status": "active",
-            "total_documents": sum(len(v) for v in files.values()),
-            "specialties": list(files.keys()),
-            "by_specialty": {k: len(v) for k, v in files.items()}
+            "total_documents": sum(by_specialty.values()),
+            "specialties": list(by_specialty.keys()),
+            "by_specialty": dict(by_specialty)
         }
 
 
@@ -0,0 +1,219 @@
+"""
+Validation Response Cache
+Two-tier cache (exact hash + semantic similarity) in front of OpenAI calls.
+"""
+
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+from models.schemas import GuidelineCheckResponse
+from services.guidelines_service import guidelines_service, RAG_AVAILABLE
+import config
+
+if RAG_AVAILABLE:
+    from langchain_community.vectorstores import Chroma
+
+
+def make_cache_key(payload: Dict[str, Any], canonical: Optional[str] = None) -> str:
+    """Canonicalize a validation payload into a stable hash key.
+
+    Callers that already hold the canonical serialization pass it in so
+    the payload isn't re-serialized just to be hashed.
+    """
+    if canonical is None:
+        canonical = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.blake2b(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for GuidelineCheckResponse objects.
+
+    Tier 1 (exact): blake2b hash of the canonicalized request → response,
+    held in a TTL cache so identical resubmissions skip OpenAI entirely.
+
+    Tier 2 (semantic): the canonicalized request is embedded with the
+    already-loaded guidelines embeddings and matched against previous
+    requests; near-duplicates (cosine ≥ threshold) reuse the cached
+    response. Only active when the RAG stack is available.
+
+    Caveat: the MiniLM embedder truncates input at 256 tokens, so only
+    the head of the sorted-JSON canonical payload (roughly the
+    active_orders block) informs the similarity score — differences
+    buried later in the serialization, e.g. deep in patient_record, can
+    slip past the cosine gate. The exact tier hashes the full payload
+    and is unaffected; callers for whom a semantic near-match is never
+    acceptable should bypass the cache instead.
+
+    Disk tier (opt-in): responses are also persisted as JSON under
+    ~/.medguide_cache keyed by the same hash, so repeated dev runs
+    against unchanged sample patients survive process restarts and cost
+    zero tokens. Enabled via MEDGUIDE_DISK_CACHE=true or per-run flags.
+    """
+
+    # Cosine similarity a request must reach to reuse a previous
+    # response. 0.97 is conservative for clinical payloads; lower it
+    # (e.g. 0.92) to catch structurally-similar presentations too.
+    SEMANTIC_THRESHOLD = config.MEDGUIDE_SEMANTIC_THRESHOLD
+
+    def __init__(self, maxsize: int = 10_000, ttl: int = 3600):
+        self.ttl = ttl
+        self._exact = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._semantic = None  # Lazily-created Chroma collection
+        # patient_id → cache keys, so order/context updates can evict
+        # that patient's entries without waiting out the TTL
+        self._keys_by_patient: Dict[str, set] = {}
+
+        self.disk_enabled = config.MEDGUIDE_DISK_CACHE
+        self.disk_dir = Path(config.MEDGUIDE_CACHE_DIR).expanduser()
+
+    # =========================
+    # Lookup
+    # =========================
+    def get(
+        self,
+        payload: Dict[str, Any],
+        canonical: Optional[str] = None
+    ) -> Optional[GuidelineCheckResponse]:
+        if canonical is None:
+            canonical = json.dumps(payload, sort_keys=True, default=str)
+        key = make_cache_key(payload, canonical)
+
+        cached = self._exact.get(key)
+        if cached is not None:
+            return cached
+
+        cached = self._disk_get(key)
+        if cached is not None:
+            return cached
+
+        return self._semantic_get(canonical)
+
+    def _disk_get(self, key: str) -> Optional[GuidelineCheckResponse]:
+        if not self.disk_enabled:
+            return None
+
+        path = self.disk_dir / f"{key}.json"
+        try:
+            if not path.is_file() or time.time() - path.stat().st_mtime > self.ttl:
+                return None
+
+            response = GuidelineCheckResponse.model_validate_json(path.read_text())
+            # Promote to the in-memory tier for the rest of the session
+            self._exact[key] = response
+            return response
+        except Exception as e:
+            print("⚠️  Disk cache read error:", e)
+            return None
+
+    def _semantic_get(self, canonical: str) -> Optional[GuidelineCheckResponse]:
+        store = self._semantic_store()
+        if store is None:
+            return None
+
+        try:
+            results = store.similarity_search_with_score(canonical, k=1)
+            if not results:
+                return None
+
+            doc, distance = results[0]
+
+            # Chroma cosine scores are distances: 0 == identical
+            if distance > (1.0 - self.SEMANTIC_THRESHOLD):
+                return None
+
+            if time.time() - doc.metadata.get("cached_at", 0) > self.ttl:
+                return None
+
+            return GuidelineCheckResponse(**json.loads(doc.metadata["response"]))
+        except Exception as e:
+            print("⚠️  Semantic cache lookup error:", e)
+            return None
+
+    # =========================
+    # Insertion
+    # =========================
+    def put(
+        self,
+        payload: Dict[str, Any],
+        response: GuidelineCheckResponse,
+        patient_id: Optional[str] = None,
+        canonical: Optional[str] = None
+    ):
+        if canonical is None:
+            canonical = json.dumps(payload, sort_keys=True, default=str)
+        key = make_cache_key(payload, canonical)
+        self._exact[key] = response
+        self._disk_put(key, response)
+
+        if patient_id:
+            self._keys_by_patient.setdefault(patient_id, set()).add(key)
+
+        store = self._semantic_store()
+        if store is None:
+            return
+
+        try:
+            store.add_texts(
+                texts=[canonical],
+                metadatas=[{
+                    "response": response.model_dump_json(),
+                    "cached_at": time.time()
+                }],
+                ids=[key]
+            )
+        except Exception as e:
+            print("⚠️  Semantic cache insert error:", e)
+
+    def _disk_put(self, key: str, response: GuidelineCheckResponse):
+        if not self.disk_enabled:
+            return
+
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            (self.disk_dir / f"{key}.json").write_text(response.model_dump_json())
+        except OSError as e:
+            print("⚠️  Disk cache write error:", e)
+
+    # =========================
+    # Invalidation
+    # =========================
+    def invalidate(self, patient_id: str):
+        """Evict all cached responses for a patient (order/context changed)."""
+        keys = self._keys_by_patient.pop(patient_id, set())
+        for key in keys:
+            self._exact.pop(key, None)
+            if self.disk_enabled:
+                (self.disk_dir / f"{key}.json").unlink(missing_ok=True)
+
+        if keys and self._semantic is not None:
+            try:
+                self._semantic.delete(ids=list(keys))
+            except Exception as e:
+                print("⚠️  Semantic cache invalidation error:", e)
+
+    # =========================
+    # Helpers
+    # =========================
+    def _semantic_store(self):
+        """Lazily create the in-memory semantic cache collection."""
+        if not RAG_AVAILABLE or not guidelines_service.embeddings:
+            return None
+
+        if self._semantic is None:
+            self._semantic = Chroma(
+                collection_name="validation_cache",
+                embedding_function=guidelines_service.embeddings,
+                collection_metadata={"hnsw:space": "cosine"}
+            )
+
+        return self._semantic
+
+
+# Global instance
+response_cache = ResponseCache()
@@ -3,9 +3,23 @@ Sample Clinical Data for Guideline Assistance Testing
 This file contains test data for prototyping the medical guideline assistance feature.
 """
 
+import functools
 from typing import Dict, List, Any
 from datetime import datetime, timedelta
 
+# Time-dependent fields are applied lazily (hours before "now") so the
+# data tracks the actual run time instead of freezing at module import
+_ADMISSION_OFFSET_HOURS = {"P001": 48, "P002": 24, "P003": 0}
+_ORDER_OFFSET_HOURS = {
+    "MED001": 24,
+    "MED002": 24,
+    "MED003": 20,
+    "MED004": 12,
+    "MED005": 12,
+    "MED006": 2,
+    "MED007": 1
+}
+
 # Sample Patient Records (De-identified)
 SAMPLE_PATIENTS = {
     "P001": {
@@ -21,7 +35,6 @@ SAMPLE_PATIENTS = {
             "Chronic Kidney Disease Stage 3"
         ],
         "current_diagnosis": "Acute Coronary Syndrome",
-        "admission_date": (datetime.now() - timedelta(days=2)).isoformat(),
         "department": "Cardiology",
         "vitals": {
             "bp_systolic": 145,
@@ -48,7 +61,6 @@ SAMPLE_PATIENTS = {
         "allergies": ["None known"],
         "comorbidities": ["Asthma", "GERD"],
         "current_diagnosis": "Community-Acquired Pneumonia",
-        "admission_date": (datetime.now() - timedelta(days=1)).isoformat(),
         "department": "Pulmonary",
         "vitals": {
             "bp_systolic": 118,
@@ -78,7 +90,6 @@ SAMPLE_PATIENTS = {
             "Chronic Kidney Disease Stage 4"
         ],
         "current_diagnosis": "Septic Shock",
-        "admission_date": datetime.now().isoformat(),
         "department": "ICU",
         "vitals": {
             "bp_systolic": 82,
@@ -107,8 +118,7 @@ SAMPLE_ORDERS = {
                 "dose": "80 mg",
                 "route": "PO",
                 "frequency": "Daily",
-                "indication": "High-intensity statin for ACS",
-                "ordered_time": (datetime.now() - timedelta(hours=24)).isoformat()
+                "indication": "High-intensity statin for ACS"
             },
             {
                 "order_id": "MED002",
@@ -116,8 +126,7 @@ SAMPLE_ORDERS = {
                 "dose": "25 mg",
                 "route": "PO",
                 "frequency": "BID",
-                "indication": "Beta-blocker for ACS",
-                "ordered_time": (datetime.now() - timedelta(hours=24)).isoformat()
+                "indication": "Beta-blocker for ACS"
             },
             {
                 "order_id": "MED003",
@@ -125,8 +134,7 @@ SAMPLE_ORDERS = {
                 "dose": "5000 units",
                 "route": "IV",
                 "frequency": "Continuous infusion",
-                "indication": "Anticoagulation for ACS",
-                "ordered_time": (datetime.now() - timedelta(hours=20)).isoformat()
+                "indication": "Anticoagulation for ACS"
             }
         ],
         "procedures": [
@@ -155,8 +163,7 @@ SAMPLE_ORDERS = {
                 "dose": "1 g",
                 "route": "IV",
                 "frequency": "Daily",
-                "indication": "Community-acquired pneumonia",
-                "ordered_time": (datetime.now() - timedelta(hours=12)).isoformat()
+                "indication": "Community-acquired pneumonia"
             },
             {
                 "order_id": "MED005",
@@ -164,8 +171,7 @@ SAMPLE_ORDERS = {
                 "dose": "500 mg",
                 "route": "PO",
                 "frequency": "Daily",
-                "indication": "Atypical coverage for CAP",
-                "ordered_time": (datetime.now() - timedelta(hours=12)).isoformat()
+                "indication": "Atypical coverage for CAP"
             }
         ],
         "procedures": [],
@@ -194,8 +200,7 @@ SAMPLE_ORDERS = {
                 "dose": "0.1 mcg/kg/min",
                 "route": "IV",
                 "frequency": "Continuous infusion",
-                "indication": "Septic shock - vasopressor support",
-                "ordered_time": (datetime.now() - timedelta(hours=2)).isoformat()
+                "indication": "Septic shock - vasopressor support"
             },
             {
                 "order_id": "MED007",
@@ -203,8 +208,7 @@ SAMPLE_ORDERS = {
                 "dose": "30 mL/kg",
                 "route": "IV",
                 "frequency": "Bolus over 3 hours",
-                "indication": "Septic shock resuscitation",
-                "ordered_time": (datetime.now() - timedelta(hours=1)).isoformat()
+                "indication": "Septic shock resuscitation"
             }
         ],
         "procedures": [
@@ -268,14 +272,52 @@ SAMPLE_CLINICAL_CONTEXT = {
     }
 }
 
+@functools.lru_cache(maxsize=None)
+def _make_patient(patient_id: str) -> Dict[str, Any]:
+    """Materialize a patient record with a run-relative admission date."""
+    record = dict(SAMPLE_PATIENTS[patient_id])
+    offset = _ADMISSION_OFFSET_HOURS.get(patient_id, 0)
+    record["admission_date"] = (
+        datetime.now() - timedelta(hours=offset)
+    ).isoformat()
+    return record
+
+
+@functools.lru_cache(maxsize=None)
+def _make_orders(patient_id: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Materialize active orders with run-relative ordered_time stamps."""
+    orders = {}
+    for category, entries in SAMPLE_ORDERS.get(patient_id, {}).items():
+        made = []
+        for entry in entries:
+            offset = _ORDER_OFFSET_HOURS.get(entry.get("order_id"))
+            if offset is not None:
+                entry = {
+                    **entry,
+                    "ordered_time": (
+                        datetime.now() - timedelta(hours=offset)
+                    ).isoformat()
+                }
+            made.append(entry)
+        orders[category] = made
+    return orders
+
+
+@functools.lru_cache(maxsize=None)
 def get_patient_data(patient_id: str) -> Dict[str, Any]:
-    """Get complete patient data including orders and context."""
+    """
+    Get complete patient data including orders and context.
+
+    Memoized — callers get the same bundle dict back and must treat
+    it as read-only. Timestamps are computed on first access, so they
+    are relative to the run rather than to module import.
+    """
     if patient_id not in SAMPLE_PATIENTS:
         return None
-    
+
     return {
-        "patient": SAMPLE_PATIENTS[patient_id],
-        "active_orders": SAMPLE_ORDERS.get(patient_id, {}),
+        "patient": _make_patient(patient_id),
+        "active_orders": _make_orders(patient_id),
         "clinical_context": SAMPLE_CLINICAL_CONTEXT.get(patient_id, {})
     }
 